@@ -10,21 +10,38 @@ python 003_get_crypto_data.py --pair BTCUSDC --interval 1h --years 5 --overwrite
 """
 
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-import time, argparse, os
+import time, argparse, os, threading, json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import requests
 from dotenv import load_dotenv
-from config import rest_client
+from config import rest_client, REST_BASE_URL, TESTNET
+
+try:  # décodage JSON rapide du chemin /klines, optionnel
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 load_dotenv()
 
 # --- Configuration ---------------------------------------------------------
 DATA_DIR = Path("data/crypto_data")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR = Path.home() / ".cache" / "trading-overview"
 
 MAX_LIMIT = 1000          # limite de l’API Binance par appel
 MAX_SPAN_DAYS = 200       # taille max d’un bloc de récupération
+MAX_WORKERS = 4           # blocs téléchargés en parallèle
+MIN_REQUEST_GAP = 0.12    # s entre deux appels /klines, tous threads confondus
+                          # (~500 req/min × poids 2 < 1200/min autorisés)
+PARQUET_ROW_GROUP = 10_000  # lignes par row group (stats min/max serrées sur open_time)
+EXCHANGE_INFO_TTL = 3600    # s avant de re-télécharger exchange_info
 
 # Colonnes renvoyées par l’endpoint /klines de Binance (12 valeurs)
 COLUMNS = [
@@ -32,6 +49,25 @@ COLUMNS = [
     "close_time", "quote_asset_volume", "nb_trades",
     "taker_buy_base", "taker_buy_quote", "ignore",
 ]
+DTYPES = {
+    "open_time": "int64", "close_time": "int64", "nb_trades": "int64",
+    **{c: "float64" for c in [
+        "open", "high", "low", "close", "volume",
+        "quote_asset_volume", "taker_buy_base", "taker_buy_quote", "ignore",
+    ]},
+}
+
+# Options d’écriture Parquet : zstd, et timestamps monotones en delta
+# (encodage incompatible avec le dictionnaire, réservé aux autres colonnes)
+_TIME_COLUMNS = ("open_time", "close_time")
+PARQUET_OPTIONS = dict(
+    compression="zstd",
+    compression_level=3,
+    use_dictionary=[c for c in COLUMNS if c not in _TIME_COLUMNS],
+    column_encoding={c: "DELTA_BINARY_PACKED" for c in _TIME_COLUMNS},
+    data_page_size=1 << 20,
+    write_statistics=True,
+)
 
 # --- Fonctions utilitaires --------------------------------------------------
 
@@ -40,19 +76,57 @@ def iso_ms(dt: datetime) -> int:
     return int(dt.timestamp() * 1_000)
 
 
-def fetch_interval(symbol: str, interval: str, start: datetime, end: datetime) -> list[pd.DataFrame]:
-    """Récupère les chandeliers entre *start* et *end* par blocs."""
-    spot = rest_client()
-    frames: list[pd.DataFrame] = []
+_throttle_lock = threading.Lock()
+_next_call_at = 0.0
+
+
+def _throttle() -> None:
+    """Espace les appels à l’API d’au moins MIN_REQUEST_GAP secondes (thread-safe)."""
+    global _next_call_at
+    with _throttle_lock:
+        now = time.monotonic()
+        wait = _next_call_at - now
+        _next_call_at = max(now, _next_call_at) + MIN_REQUEST_GAP
+    if wait > 0:
+        time.sleep(wait)
+
+
+_http = threading.local()
+
+
+def _klines_fast(symbol: str, interval: str, start_ms: int, end_ms: int) -> list[list]:
+    """Appelle ``/api/v3/klines`` directement et décode la réponse avec orjson.
+
+    Contourne binance-connector (qui décode avec le ``json`` de la stdlib) sur
+    le chemin chaud. Chaque thread garde sa propre ``requests.Session`` pour
+    réutiliser la connexion entre les pages d’un bloc.
+    """
+    session = getattr(_http, "session", None)
+    if session is None:
+        session = _http.session = requests.Session()
+    r = session.get(
+        f"{REST_BASE_URL}/api/v3/klines",
+        params={
+            "symbol": symbol, "interval": interval,
+            "startTime": start_ms, "endTime": end_ms, "limit": MAX_LIMIT,
+        },
+        timeout=30,
+    )
+    r.raise_for_status()
+    return json_loads(r.content)
+
+
+def fetch_interval(symbol: str, interval: str, start: datetime, end: datetime) -> list[list]:
+    """Récupère les chandeliers bruts (listes de 12 valeurs) entre *start* et *end*.
+
+    *end* est exclu, de sorte que deux blocs contigus ne se chevauchent pas.
+    """
+    rows: list[list] = []
     cur = start
     while cur < end:
+        _throttle()  # respect API
         try:
-            kl = spot.klines(
-                symbol, interval,
-                startTime=iso_ms(cur),
-                endTime=iso_ms(end),
-                limit=MAX_LIMIT,
-            )
+            kl = _klines_fast(symbol, interval, iso_ms(cur), iso_ms(end) - 1)
         except Exception as e:
             print(f"❌ Erreur sur {symbol} – {e}")
             return []
@@ -60,38 +134,125 @@ def fetch_interval(symbol: str, interval: str, start: datetime, end: datetime) -
         if not kl:  # plus de données dispo
             break
 
-        # Conversion en DataFrame complet (12 colonnes)
-        df = pd.DataFrame(kl, columns=COLUMNS)
-        df = df.astype({
-            "open_time": "int64", "close_time": "int64", "nb_trades": "int64",
-            **{c: "float64" for c in [
-                "open", "high", "low", "close", "volume",
-                "quote_asset_volume", "taker_buy_base", "taker_buy_quote", "ignore",
-            ]},
-        })
-        frames.append(df)
+        rows.extend(kl)
 
         # si moins que MAX_LIMIT, nous avons atteint la fin
         if len(kl) < MAX_LIMIT:
             break
 
         # sinon, avance d’une milliseconde après la dernière bougie
-        last_close_ms = int(df.iloc[-1]["close_time"])
+        last_close_ms = int(kl[-1][6])
         cur = datetime.fromtimestamp((last_close_ms + 1) / 1000, tz=timezone.utc)
-        time.sleep(0.25)  # respect API
 
-    return frames
+    return rows
+
+
+def to_frame(rows: list[list]) -> pd.DataFrame:
+    """Construit le DataFrame complet (12 colonnes typées) à partir des klines bruts."""
+    return pd.DataFrame(rows, columns=COLUMNS).astype(DTYPES)
+
+
+def read_klines(path: Path) -> pd.DataFrame:
+    """Lit un fichier Parquet de klines via PyArrow (lecture multi-thread)."""
+    table = pq.read_table(path, use_threads=True)
+    return table.to_pandas(self_destruct=True)
+
+
+def write_klines(df: pd.DataFrame, path: Path) -> None:
+    """Écrit *df* en Parquet via PyArrow, sans l’index pandas."""
+    pq.write_table(
+        pa.Table.from_pandas(df, preserve_index=False),
+        path,
+        row_group_size=PARQUET_ROW_GROUP,
+        **PARQUET_OPTIONS,
+    )
+
+
+def _meta_path(path: Path) -> Path:
+    """Fichier annexe ``<pair>_<interval>.meta.json`` associé à *path*."""
+    return path.with_suffix(".meta.json")
+
+
+def write_watermark(path: Path, max_open_time: int, n_rows: int) -> None:
+    """Mémorise le dernier ``open_time`` et le nombre de lignes de *path*."""
+    with open(_meta_path(path), "w", encoding="utf-8") as fp:
+        json.dump({"max_open_time": int(max_open_time), "n_rows": int(n_rows)}, fp)
+
+
+def last_open_time(path: Path, *, use_meta: bool = True) -> int:
+    """Renvoie le plus grand ``open_time`` de *path* sans lire les données.
+
+    Utilise le fichier annexe ``.meta.json`` s’il est au moins aussi récent que
+    le Parquet (et si ``use_meta``), sinon les statistiques des row groups
+    (lecture du footer seul). En dernier recours, seule la colonne
+    ``open_time`` est lue.
+    """
+    meta = _meta_path(path)
+    if use_meta and meta.exists() and meta.stat().st_mtime >= path.stat().st_mtime:
+        with open(meta, encoding="utf-8") as fp:
+            return json.load(fp)["max_open_time"]
+
+    md = pq.read_metadata(path)
+    col = md.schema.names.index("open_time")
+    stats = [md.row_group(i).column(col).statistics for i in range(md.num_row_groups)]
+    if stats and all(st is not None and st.has_min_max for st in stats):
+        return max(st.max for st in stats)
+
+    col = pq.read_table(path, columns=["open_time"])["open_time"]
+    return pc.max(col).as_py()
+
+
+def append_klines(df: pd.DataFrame, path: Path) -> int:
+    """Ajoute *df* à la fin de *path* sans charger tout l’historique en mémoire.
+
+    Les row groups complets sont recopiés un à un dans un fichier temporaire ;
+    le dernier (souvent partiel) est fusionné avec les nouvelles lignes, ce qui
+    évite l’accumulation de petits row groups au fil des mises à jour. Le
+    fichier temporaire remplace ensuite l’original. Renvoie le nombre total
+    de lignes.
+    """
+    tmp = path.with_suffix(".parquet.tmp")
+    with pq.ParquetFile(path) as src:
+        schema = src.schema_arrow
+        new = pa.Table.from_pandas(df, preserve_index=False).cast(schema)
+        last = src.num_row_groups - 1
+        with pq.ParquetWriter(tmp, schema, **PARQUET_OPTIONS) as writer:
+            for i in range(last):
+                writer.write_table(src.read_row_group(i))
+            tail = src.read_row_group(last) if last >= 0 else schema.empty_table()
+            writer.write_table(pa.concat_tables([tail, new]), row_group_size=PARQUET_ROW_GROUP)
+        n_rows = src.metadata.num_rows + new.num_rows
+    os.replace(tmp, path)
+    return n_rows
+
+
+def _cached_exchange_info(ttl: int = EXCHANGE_INFO_TTL) -> dict:
+    """Renvoie ``exchange_info()`` depuis le cache disque s’il a moins de *ttl* secondes."""
+    cache = CACHE_DIR / f"exchange_info{'_testnet' if TESTNET else ''}.json"
+    if cache.exists() and time.time() - cache.stat().st_mtime < ttl:
+        with open(cache, encoding="utf-8") as fp:
+            return json.load(fp)
+
+    info = rest_client().exchange_info()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(cache, "w", encoding="utf-8") as fp:
+        json.dump(info, fp)
+    return info
+
+
+@lru_cache(maxsize=1)
+def _trading_symbols_by_quote() -> dict[str, frozenset[str]]:
+    """Indexe une seule fois les symboles TRADING par asset coté."""
+    by_quote: dict[str, set[str]] = {}
+    for s in _cached_exchange_info()["symbols"]:
+        if s["status"] == "TRADING":
+            by_quote.setdefault(s["quoteAsset"], set()).add(s["symbol"])
+    return {q: frozenset(syms) for q, syms in by_quote.items()}
 
 
 def get_available_symbols(quote_asset: str = "USDC") -> set[str]:
     """Renvoie l’ensemble des symboles TRADING avec l’asset coté donné."""
-    spot = rest_client()
-    info = spot.exchange_info()
-    return {
-        s["symbol"]
-        for s in info["symbols"]
-        if s["quoteAsset"] == quote_asset and s["status"] == "TRADING"
-    }
+    return set(_trading_symbols_by_quote().get(quote_asset, ()))
 
 # --- Routine principale -----------------------------------------------------
 
@@ -110,14 +271,14 @@ def main(pair: str, interval: str, years: int, overwrite: bool):
 
     if overwrite and target.exists():
         target.unlink()  # on repart de zéro
+        _meta_path(target).unlink(missing_ok=True)
 
-    if target.exists():
-        existing = pd.read_parquet(target)
-        last_open_ms = existing["open_time"].max()
+    update = target.exists()
+    if update:
+        last_open_ms = last_open_time(target)
         start_fetch = datetime.fromtimestamp((last_open_ms + 1) / 1000, tz=timezone.utc)
         print(f"📄 Mise à jour de {target.name} – nouvelles données depuis {start_fetch:%Y-%m-%d %H:%M}")
     else:
-        existing = None
         start_fetch = start_date
         print(f"📄 Création de {target.name} – données depuis {start_date:%Y-%m-%d}")
 
@@ -125,42 +286,52 @@ def main(pair: str, interval: str, years: int, overwrite: bool):
         print("✅ Aucune nouvelle donnée à récupérer.")
         return
 
-    # Récupération par blocs de MAX_SPAN_DAYS
-    frames: list[pd.DataFrame] = []
+    # Découpage en blocs de MAX_SPAN_DAYS, récupérés en parallèle
+    blocks: list[tuple[datetime, datetime]] = []
     cur_blk = start_fetch
     while cur_blk < end_date:
         blk_end = min(cur_blk + timedelta(days=MAX_SPAN_DAYS), end_date)
-        print(f"  ▸ Bloc {cur_blk:%Y-%m-%d} → {blk_end:%Y-%m-%d}")
-        frames.extend(fetch_interval(pair, interval, cur_blk, blk_end))
+        blocks.append((cur_blk, blk_end))
         cur_blk = blk_end
-        time.sleep(0.35)
 
-    if not frames:
+    rows: list[list] = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = pool.map(lambda blk: fetch_interval(pair, interval, *blk), blocks)
+        for (blk_start, blk_end), blk_rows in zip(blocks, results):
+            print(f"  ▸ Bloc {blk_start:%Y-%m-%d} → {blk_end:%Y-%m-%d}")
+            rows.extend(blk_rows)
+
+    if not rows:
         print("❌ Aucun kline récupéré.")
         return
 
-    new_data = (
-        pd.concat(frames, ignore_index=True)
-        .drop_duplicates("open_time")
-        .sort_values("open_time")
-        .reset_index(drop=True)
-    )
-
-    # Fusion avec l’existant si besoin
-    if existing is not None:
-        full = pd.concat([existing, new_data], ignore_index=True)
+    # Blocs disjoints et renvoyés dans l’ordre : ni doublon ni tri nécessaire
+    new_data = to_frame(rows)
+
+    # Ajout en fin de fichier : les nouvelles bougies sont normalement toutes
+    # postérieures au dernier open_time du fichier, donc déjà triées et sans
+    # doublon. On le vérifie sur le footer du Parquet (et non sur le .meta.json
+    # qui a servi à choisir start_fetch) ; en cas de chevauchement, on repasse
+    # par une fusion complète dédoublonnée.
+    max_open_ms = new_data["open_time"].max()
+    if update and new_data["open_time"].min() > last_open_time(target, use_meta=False):
+        n_total = append_klines(new_data, target)
+    elif update:
         full = (
-            full.drop_duplicates("open_time")
+            pd.concat([read_klines(target), new_data], ignore_index=True)
+            .drop_duplicates("open_time")
             .sort_values("open_time")
             .reset_index(drop=True)
         )
+        write_klines(full, target)
+        n_total = len(full)
+        max_open_ms = full["open_time"].iat[-1]
     else:
-        full = new_data
-
-    # Sauvegarde complète (12 colonnes)
-    full.to_parquet(target, index=False)
+        write_klines(new_data, target)
+        n_total = len(new_data)
+    write_watermark(target, max_open_ms, n_total)
 
-    print(f"✅ {len(new_data):,} nouvelles lignes – total {len(full):,} lignes sauvegardées dans {target}")
+    print(f"✅ {len(new_data):,} nouvelles lignes – total {n_total:,} lignes sauvegardées dans {target}")
 
 # --- Script -----------------------------------------------------------------
 
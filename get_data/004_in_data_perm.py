@@ -16,11 +16,16 @@ python get_data/004_in_data_perm.py
 """
 from __future__ import annotations
 
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # === CONFIGURATION =========================================================
 INPUT_FILE      = "data/crypto_data/btcusdc_1d.parquet"  # Source parquet
@@ -30,8 +35,13 @@ N_PERM          = 50                                      # # permutations / seg
 LAST_N_BARS     = 2000                                    # Window size (counting from end)
 PERMUTE_RATIO   = 0.8                                     # 0 < ratio < 1 → share for IN
 SEED            = 42                                      # None → fully random
+STACK_PERMS     = False                                   # True → one file, perm_id column
 # ===========================================================================
 
+# Permutations drawn from each independent RNG stream.  Fixed (rather than
+# derived from the core count) so a given SEED gives the same output anywhere.
+_PERM_CHUNK = 16
+
 def _permute_segment(
     df: pd.DataFrame,
     seg_start: int,
@@ -39,10 +49,15 @@ def _permute_segment(
     *,
     n_perm: int,
     seed: int | None = None,
-) -> List[pd.DataFrame]:
+) -> List[pa.Table]:
     """Return *n_perm* permutations of ``df`` restricted to ``[seg_start, seg_end]``.
 
-    Bars outside this inclusive range remain identical to the original.  The
+    Each permutation is an Arrow table with ``open/high/low/close`` columns
+    and ``df``'s pandas metadata (so the index round-trips as the index),
+    built straight from 1‑D arrays so it can be written without a pandas
+    round-trip.
+    Bars outside this inclusive range hold the original float64 values (the
+    files written by ``_write_perms`` store them as float32, see there).  The
     permutation preserves the statistical structure of OHLC bars by
     shuffling (H/L/C) ranges together and (open–close) gaps independently, as
     proposed in López de Prado 2018, *Advances in Financial Machine Learning*.
@@ -50,80 +65,209 @@ def _permute_segment(
 
     assert 0 <= seg_start <= seg_end < len(df), "invalid segment boundaries"
 
-    # ---- Pre‑compute log‑prices and relative moves in the segment ----------
-    logp = np.log(df[["open", "high", "low", "close"]])
-    gap_open  = (logp["open"]  - logp["close"].shift()).to_numpy()[seg_start : seg_end + 1]
-    rel_high  = (logp["high"]  - logp["open"]).to_numpy()[seg_start : seg_end + 1]
-    rel_low   = (logp["low"]   - logp["open"]).to_numpy()[seg_start : seg_end + 1]
-    rel_close = (logp["close"] - logp["open"]).to_numpy()[seg_start : seg_end + 1]
-
-    seg_len    = seg_end - seg_start + 1
-    time_index = df.index
-
-    def _one_perm(rng: np.random.Generator) -> pd.DataFrame:
-        # --------------- Random ordering (independent gaps vs bodies) -------
-        order_bar = rng.permutation(seg_len)  # high/low/close together
-        order_gap = rng.permutation(seg_len)  # gaps independently
-
-        _rel_high  = rel_high[order_bar]
-        _rel_low   = rel_low[order_bar]
-        _rel_close = rel_close[order_bar]
-        _gap_open  = gap_open[order_gap]
-
-        # --- Build output ---------------------------------------------------
-        bars = logp.to_numpy().copy()
-
-        # Anchor on bar just before the segment (or on itself if at pos 0)
-        anchor_idx   = seg_start - 1 if seg_start > 0 else seg_start
-        last_close   = bars[anchor_idx, 3]
-
-        for k in range(seg_len):
-            i_row = seg_start + k
-            bars[i_row, 0] = last_close + _gap_open[k]    # open
-            bars[i_row, 1] = bars[i_row, 0] + _rel_high[k]
-            bars[i_row, 2] = bars[i_row, 0] + _rel_low[k]
-            bars[i_row, 3] = bars[i_row, 0] + _rel_close[k]
-            last_close     = bars[i_row, 3]
-
-        return pd.DataFrame(
-            np.exp(bars), index=time_index, columns=["open", "high", "low", "close"]
-        )
+    # Anchor on bar just before the segment (none when it starts at pos 0)
+    anchor_idx = seg_start - 1 if seg_start > 0 else seg_start
 
-    master = np.random.default_rng(seed)
-    return [
-        _one_perm(np.random.default_rng(master.integers(0, 2**32 - 1)))
-        for _ in range(n_perm)
-    ]
+    # OHLC leaves pandas once, column-major: one contiguous row per field
+    cols = ["open", "high", "low", "close"]
+    ohlc = np.ascontiguousarray(df[cols].to_numpy(dtype=np.float64).T)
+
+    # ---- Pre‑compute log‑prices and relative moves in the segment ----------
+    # Only the anchor bar and the segment itself are ever read, so the log is
+    # taken on that slice alone; ``off`` maps segment rows into it.
+    l_open, l_high, l_low, l_close = np.log(ohlc[:, anchor_idx : seg_end + 1])
+    off = seg_start - anchor_idx
+
+    # Close preceding each segment bar.  At pos 0 there is none: the first
+    # open stands in for it (zero gap) and also serves as the anchor.
+    if off:
+        prev_close   = l_close[:-1]
+        anchor_close = l_close[0]
+    else:
+        prev_close   = np.concatenate((l_open[:1], l_close[:-1]))
+        anchor_close = l_open[0]
+
+    seg_open  = l_open[off:]
+    gap_open  = seg_open - prev_close
+    rel_high  = l_high[off:]  - seg_open
+    rel_low   = l_low[off:]   - seg_open
+    rel_close = l_close[off:] - seg_open
+
+    seg_len = seg_end - seg_start + 1
+
+    # ---- Rebuild bars in one preallocated (4, n_perm, seg_len) buffer -------
+    # close_k = anchor + Σ_{j<=k} (gap_j + body_j) ; open_k = close_k - body_k
+    rebuilt = np.empty((4, n_perm, seg_len))
+
+    def _rebuild(stream: np.random.SeedSequence, rows: slice) -> None:
+        rng = np.random.default_rng(stream)
+        opens, highs, lows, closes = rebuilt[:, rows]
+
+        # Random orderings, one row per permutation: both sets of orderings
+        # (H/L/C bodies together, gaps independently) in a single call
+        k = closes.shape[0]
+        orders = np.tile(np.arange(seg_len), (2 * k, 1))
+        rng.permuted(orders, axis=1, out=orders)
+        order_bar, order_gap = orders[:k], orders[k:]
+
+        np.take(gap_open, order_gap, out=closes)
+        np.take(rel_close, order_bar, out=opens)   # bodies, reused below
+        closes += opens
+        np.cumsum(closes, axis=1, out=closes)
+        closes += anchor_close
+        np.subtract(closes, opens, out=opens)
+        np.take(rel_high, order_bar, out=highs)
+        highs += opens
+        np.take(rel_low, order_bar, out=lows)
+        lows += opens
+
+        np.exp(rebuilt[:, rows], out=rebuilt[:, rows])  # back to prices
+
+    # ---- Dispatch chunks of permutations to threads (NumPy releases the GIL)
+    chunks  = [slice(lo, lo + _PERM_CHUNK) for lo in range(0, n_perm, _PERM_CHUNK)]
+    streams = np.random.SeedSequence(seed).spawn(len(chunks))
+    workers = max(1, min(len(chunks), os.cpu_count() or 1))
+
+    # Untouched prefix/suffix are taken from the original prices (no exp
+    # needed) and wrapped once as read-only Arrow arrays.  Every permutation
+    # is then a zero-copy chunked column: shared prefix, its own row of
+    # ``rebuilt`` and shared suffix, so ``rebuilt`` is the only per-perm memory.
+    prefix = [pa.array(row) for row in ohlc[:, :seg_start]]
+    suffix = [pa.array(row) for row in ohlc[:, seg_end + 1 :]]
+    # Index column(s) (none for a RangeIndex) and pandas metadata, taken
+    # once from ``df`` so the index reads back exactly as ``df.to_parquet``'s
+    index_tbl   = pa.Table.from_pandas(df.iloc[:, :0])
+    index_cols  = dict(zip(index_tbl.column_names, index_tbl.columns))
+    pandas_meta = pa.Schema.from_pandas(df[cols]).metadata
+
+    def _one_perm(i: int) -> pa.Table:
+        return pa.table({
+            **{
+                col: pa.chunked_array([prefix[j], pa.array(rebuilt[j, i]), suffix[j]])
+                for j, col in enumerate(cols)
+            },
+            **index_cols,
+        }).replace_schema_metadata(pandas_meta)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_rebuild, streams, chunks))
+    return [_one_perm(i) for i in range(n_perm)]
+
+
+def _share_file(src: Path, dst: Path, *, link: bool = True) -> None:
+    """Hard-link *src* to *dst*, or copy it when linking is off or not possible."""
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:  # other filesystem, or links unsupported
+            pass
+    shutil.copy2(src, dst)
 
 
 def _write_perms(
-    perms: List[pd.DataFrame],
+    perms: List[pa.Table],
     out_dir: Path,
     base_name: str,
     *,
-    original: pd.DataFrame | None = None,
+    original: pd.DataFrame | Path | None = None,
+    link_original: bool = True,
 ) -> List[Path]:
-    """Save permutations (and optionally the original) inside *out_dir*."""
+    """Save permutations (and optionally the original) inside *out_dir*.
+
+    Files are independent, so they are encoded and written concurrently by a
+    thread pool (pyarrow releases the GIL while writing).  ``original`` may be
+    a DataFrame to serialise or the path of an existing parquet file, which is
+    then hard-linked (copied when ``link_original`` is false) instead of being
+    encoded again.
+    """
 
     out_dir.mkdir(parents=True, exist_ok=True)
     written: List[Path] = []
+    jobs: List[Tuple[pd.DataFrame | pa.Table, Path, bool]] = []  # (data, path, as float32)
 
     if original is not None:
         orig_path = out_dir / f"{base_name}_perm000.parquet"
         if not orig_path.exists():
-            original.to_parquet(orig_path)
+            if isinstance(original, Path):
+                _share_file(original, orig_path, link=link_original)
+            else:
+                jobs.append((original, orig_path, False))
         written.append(orig_path)
 
-    for i, p_df in enumerate(perms, start=1):
+    # Permuted OHLC is stored as float32: ~6e-8 relative error, i.e. below a
+    # price tick, for half the bytes.  The original keeps its own dtypes.
+    for i, p_tbl in enumerate(perms, start=1):
         p_path = out_dir / f"{base_name}_perm{i:03d}.parquet"
-        p_df.to_parquet(p_path)
+        jobs.append((p_tbl, p_path, True))
         written.append(p_path)
+
+    def _write(job: Tuple[pd.DataFrame | pa.Table, Path, bool]) -> None:
+        data, path, as_float32 = job
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data)
+        if as_float32:
+            table = table.cast(pa.schema([
+                pa.field(f.name, pa.float32()) if pa.types.is_float64(f.type) else f
+                for f in table.schema
+            ], metadata=table.schema.metadata))
+        pq.write_table(
+            table, path,
+            compression="zstd", compression_level=3, use_dictionary=False,
+        )
+
+    with ThreadPoolExecutor(max_workers=min(16, 2 * (os.cpu_count() or 1))) as pool:
+        list(pool.map(_write, jobs))
     return written
 
 
+def _write_stacked(
+    perms: List[pa.Table],
+    out_dir: Path,
+    base_name: str,
+    *,
+    original: pd.DataFrame | None = None,
+) -> Path:
+    """Stack permutations (and optionally the original) into one parquet file.
+
+    Rows carry a ``perm_id`` column (0 = original, i = ``perm{i:03d}``).  Each
+    permutation is its own row group, so a reader filtering on ``perm_id``
+    (``pq.read_table(path, filters=[("perm_id", "==", i)])``) only decodes
+    the requested one.  Only OHLC columns are kept,
+    stored as float32 like the per-file output – the original included, the
+    full-precision bars remaining available in the source parquet.
+    """
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cols = ["open", "high", "low", "close"]
+    tables = [t.select(cols) for t in perms]
+    first_id = 1
+    if original is not None:
+        tables.insert(0, pa.Table.from_pandas(original[cols], preserve_index=False))
+        first_id = 0
+
+    schema = pa.schema(
+        [pa.field("perm_id", pa.int16())] + [pa.field(c, pa.float32()) for c in cols]
+    )
+    path = out_dir / f"{base_name}_perms.parquet"
+    with pq.ParquetWriter(
+        path, schema, compression="zstd", compression_level=3, use_dictionary=["perm_id"],
+    ) as writer:
+        for perm_id, tbl in enumerate(tables, start=first_id):
+            ids = pa.array(np.full(tbl.num_rows, perm_id, dtype=np.int16))
+            writer.write_table(
+                pa.table([ids] + [c.cast(pa.float32()) for c in tbl.columns], schema=schema)
+            )
+    return path
+
+
 def main() -> None:
     # ----------------------- Load -----------------------------------------
-    df = pd.read_parquet(Path(INPUT_FILE).expanduser())
+    # Only OHLC (plus any stored index) is needed: the original itself is
+    # copied as perm000 rather than decoded and re-encoded
+    src = Path(INPUT_FILE).expanduser()
+    df = pq.read_pandas(
+        src, columns=["open", "high", "low", "close"], memory_map=True
+    ).to_pandas()
     n_bars = len(df)
 
     # ----------------------- Window definition ----------------------------
@@ -150,12 +294,24 @@ def main() -> None:
 
     # ----------------------- Write on disk --------------------------------
     base_name = Path(INPUT_FILE).stem
-    in_paths = _write_perms(
-        perms_in, Path(IN_OUTPUT_DIR).expanduser() / base_name, base_name, original=df
-    )
-    out_paths = _write_perms(
-        perms_out, Path(OUT_OUTPUT_DIR).expanduser() / base_name, base_name, original=df
-    )
+    if STACK_PERMS:
+        in_paths = [_write_stacked(
+            perms_in, Path(IN_OUTPUT_DIR).expanduser() / base_name, base_name, original=df
+        )]
+        out_paths = [_write_stacked(
+            perms_out, Path(OUT_OUTPUT_DIR).expanduser() / base_name, base_name, original=df
+        )]
+    else:
+        # The source is copied once (IN tree), never linked: 003 may rewrite
+        # it in place.  The OUT tree then links the IN copy.
+        in_paths = _write_perms(
+            perms_in, Path(IN_OUTPUT_DIR).expanduser() / base_name, base_name,
+            original=src, link_original=False,
+        )
+        out_paths = _write_perms(
+            perms_out, Path(OUT_OUTPUT_DIR).expanduser() / base_name, base_name,
+            original=in_paths[0],
+        )
 
     # ----------------------- Feedback -------------------------------------
     cwd = Path.cwd()
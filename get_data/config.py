@@ -9,12 +9,12 @@ load_dotenv()
 BINANCE_API_KEY    = os.getenv("BINANCE_API_KEY")
 BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET")
 TESTNET            = bool(int(os.getenv("BINANCE_TESTNET", "0")))
+REST_BASE_URL      = "https://testnet.binance.vision" if TESTNET else "https://api.binance.com"
 
 def rest_client() -> Client:
-    base = "https://testnet.binance.vision" if TESTNET else "https://api.binance.com"
     return Client(api_key=BINANCE_API_KEY,
                   api_secret=BINANCE_API_SECRET,
-                  base_url=base)
+                  base_url=REST_BASE_URL)
 
 def ws_client(on_msg):
     url = "wss://testnet.binance.vision/ws" if TESTNET else None
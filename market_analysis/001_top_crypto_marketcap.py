@@ -23,23 +23,20 @@ from pathlib import Path
 from typing import Dict, List
 
 import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # optional: faster (de)serialisation, stdlib json otherwise
+    import orjson
+except ImportError:
+    orjson = None
 
 # ────────────────────────────────────────────────────────────────────────────────
 # .env loader --------------------------------------------------------------------
 # ────────────────────────────────────────────────────────────────────────────────
 
-def _load_dotenv(path: str = ".env") -> None:
-    if not os.path.isfile(path):
-        return
-    with open(path, encoding="utf-8") as fp:
-        for line in fp:
-            if "=" not in line or line.lstrip().startswith("#"):
-                continue
-            k, v = line.rstrip().split("=", 1)
-            os.environ.setdefault(k.strip(), v.strip())
-
-
-_load_dotenv()
+load_dotenv()  # existing environment variables take precedence
 API_KEY = os.getenv("COINGECKO_API_KEY")
 
 BASE = "https://pro-api.coingecko.com/api/v3" if API_KEY else "https://api.coingecko.com/api/v3"
@@ -54,6 +51,24 @@ MARKETS = f"{BASE}/coins/markets"
 TARGET_DIR = Path("data/market_analysis")
 DEFAULT_TOP_N = 20
 
+# One keep-alive session for every call (incl. the public-API fallback).
+# Transient errors/rate limits are retried with backoff; the last response is
+# still returned so _http_get can report it.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            raise_on_status=False,
+        ),
+    ),
+)
+
 # ────────────────────────────────────────────────────────────────────────────────
 # Helpers ------------------------------------------------------------------------
 # ────────────────────────────────────────────────────────────────────────────────
@@ -63,7 +78,7 @@ def _yymmdd(d: dt.date) -> str:
 
 
 def _http_get(url: str, **kwargs):
-    r = requests.get(url, headers=HEADERS, timeout=30, **kwargs)
+    r = _SESSION.get(url, headers=HEADERS, timeout=30, **kwargs)
     try:
         r.raise_for_status()
         return r
@@ -72,6 +87,10 @@ def _http_get(url: str, **kwargs):
         raise RuntimeError(f"HTTP {exc.response.status_code} – {body}") from None
 
 
+def _loads(raw: bytes):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
 def _fallback_to_public_api():
     global BASE, MARKETS
     print("[INFO] Falling back to public CoinGecko API (demo key detected)")
@@ -91,11 +110,11 @@ def fetch_market_data(n: int) -> List[Dict]:
         "sparkline": "false",
     }
     try:
-        return _http_get(MARKETS, params=params).json()
+        return _loads(_http_get(MARKETS, params=params).content)
     except RuntimeError as err:
         if "10011" in str(err) or "Demo API key" in str(err):
             _fallback_to_public_api()
-            return _http_get(MARKETS, params=params).json()
+            return _loads(_http_get(MARKETS, params=params).content)
         raise
 
 
@@ -117,8 +136,11 @@ def save_snapshot(data: List[Dict], date: dt.date, overwrite: bool) -> Path:
     path = TARGET_DIR / f"{_yymmdd(date)}_top_crypto_history.json"
     if path.exists() and not overwrite:
         raise FileExistsError(f"File {path} exists (use --overwrite)")
-    with open(path, "w", encoding="utf-8") as fp:
-        json.dump(data, fp, indent=2)
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(data, fp, indent=2)
     return path
 
 # ────────────────────────────────────────────────────────────────────────────────